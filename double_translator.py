@@ -1,17 +1,37 @@
 from gpiozero import LED, Button, DigitalInputDevice
 import time
-import queue
-import numpy as np
+import os
+
+# Cap the BLAS/OpenMP pools before the inference libraries import, and pin
+# the process to that many cores, so CTranslate2, ONNX Runtime, Vosk and
+# Piper do not oversubscribe the Pi's four cores against each other.
+NUM_THREADS = min(4, os.cpu_count() or 1)
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_var, str(NUM_THREADS))
+if hasattr(os, "sched_setaffinity"):
+    os.sched_setaffinity(0, set(range(NUM_THREADS)))
+
 import sounddevice as sd
 import sys
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import re
+import wave
 import vosk
 import ctranslate2
 import sentencepiece as spm
 import subprocess
-import os
-import gc
+import ctypes
+from functools import lru_cache
+
+vosk.SetLogLevel(-1)
 from deepmultilingualpunctuation import PunctuationModel
+try:
+    from piper import PiperVoice
+except ImportError:
+    PiperVoice = None  # fall back to the standalone piper binary
 
 # --- Audio Device Settings (with automatic runtime detection) ---
 
@@ -90,6 +110,19 @@ record_button = Button(BUTTON_PIN, pull_up=True)
 direction_switch = DigitalInputDevice(SWITCH_PIN, pull_up=False)
 exit_button = Button(EXIT_BUTTON_PIN, pull_up=True, bounce_time=0.1)  # Debounced
 
+# Single wake event: every GPIO edge we care about sets it, and the wait
+# loops below block on it instead of polling every 10 ms, then re-check
+# their level-based conditions on each wake.
+WAKE_EVT = threading.Event()
+
+def _wake():
+    WAKE_EVT.set()
+
+record_button.when_pressed = _wake
+record_button.when_released = _wake
+direction_switch.when_activated = _wake
+direction_switch.when_deactivated = _wake
+
 # --- Model Paths ---
 VOSK_EN = "vosk_models/vosk-model-small-en-us-0.15"
 VOSK_ES = "vosk_models/vosk-model-small-es-0.42"
@@ -112,17 +145,117 @@ NO_AUDIO_EN_FILE = "./no_audio-en-quieter.wav"
 NO_AUDIO_ES_FILE = "./no_audio-es-quieter.wav"
 EXIT_FILE = "./exit1.wav"
 
+PROMPT_FILES = [MODE_EN_ES_FILE, MODE_ES_EN_FILE, NO_AUDIO_EN_FILE, NO_AUDIO_ES_FILE, EXIT_FILE]
+PROMPTS = {}
+
+def preload_prompts():
+    """
+    Read the short announcement WAVs into memory once so playing one is a
+    single pipe write instead of an aplay fork plus a file read from SD.
+    """
+    for path in PROMPT_FILES:
+        if not os.path.exists(path):
+            print(f"Audio file missing: {path}")
+            continue
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() != 2:
+                continue  # not S16_LE; leave it to the per-file aplay fallback
+            PROMPTS[path] = {
+                "data": w.readframes(w.getnframes()),
+                "rate": w.getframerate(),
+                "channels": w.getnchannels(),
+            }
+
+preload_prompts()
+
 # --- Global Model Holders ---
+# Both directions are loaded once at startup and kept in MODELS; switching
+# direction just rebinds the globals below (see load_models).
+MODELS = {}
 current_direction = None
 vosk_model = None
+recognizer = None
 translator = None
 sp_source = None
 sp_target = None
 piper_voice = None
 piper_config = None
+piper_tts = None
+use_vmap = False
 
 # --- Punctuation Model ---
-punct_model = PunctuationModel(model="kredor/punctuate-all")
+# An INT8 ONNX export of kredor/punctuate-all is used when present
+# (exported offline with `optimum-cli export onnx` then
+# onnxruntime.quantization.quantize_dynamic); it is several times faster
+# and smaller on the Pi. The FP32 transformers pipeline stays as fallback.
+PUNCT_ONNX_DIR = "./punct_onnx"
+PUNCT_ONNX_INT8 = os.path.join(PUNCT_ONNX_DIR, "model_int8.onnx")
+PUNCT_CHUNK_WORDS = 230  # words labeled per forward pass, as in PunctuationModel
+PUNCT_CTX_WORDS = 30     # extra context words carried on each side of a chunk
+
+class OnnxPunctuationModel:
+    """Drop-in replacement for PunctuationModel backed by ONNX Runtime."""
+
+    def __init__(self, model_path, tokenizer_dir):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = NUM_THREADS
+        self.session = ort.InferenceSession(
+            model_path, sess_options=so, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+        config_path = os.path.join(tokenizer_dir, "config.json")
+        with open(config_path) as f:
+            id2label = json.load(f)["id2label"]
+        self.labels = [id2label[str(i)] for i in range(len(id2label))]
+
+    def _predict_labels(self, words):
+        """Return one punctuation label per word."""
+        enc = self.tokenizer(
+            words, is_split_into_words=True, return_tensors="np",
+            truncation=True, max_length=512
+        )
+        inputs = {name: enc[name] for name in self.input_names if name in enc}
+        logits = self.session.run(None, inputs)[0][0]
+        preds = logits.argmax(axis=-1)
+        # Punctuation attaches after a word, so use the prediction on the
+        # last subword of each word; a word lost to truncation gets "0".
+        last_token = {}
+        for idx, word_id in enumerate(enc.word_ids(0)):
+            if word_id is not None:
+                last_token[word_id] = idx
+        return [
+            self.labels[preds[last_token[i]]] if i in last_token else "0"
+            for i in range(len(words))
+        ]
+
+    def restore_punctuation(self, text):
+        # XLM-RoBERTa positions cap at 512 tokens, so long hold-to-record
+        # transcripts are labeled in overlapping word chunks like the
+        # original PunctuationModel does; only the core of each chunk is
+        # kept, the context words just inform the predictions.
+        words = text.split()
+        if not words:
+            return text
+        out = []
+        start = 0
+        while start < len(words):
+            end = min(len(words), start + PUNCT_CHUNK_WORDS)
+            ctx_start = max(0, start - PUNCT_CTX_WORDS)
+            ctx_end = min(len(words), end + PUNCT_CTX_WORDS)
+            labels = self._predict_labels(words[ctx_start:ctx_end])
+            for i in range(start, end):
+                label = labels[i - ctx_start]
+                out.append(words[i] + label if label != "0" else words[i])
+            start = end
+        return " ".join(out)
+
+if os.path.exists(PUNCT_ONNX_INT8):
+    punct_model = OnnxPunctuationModel(PUNCT_ONNX_INT8, PUNCT_ONNX_DIR)
+else:
+    punct_model = PunctuationModel(model="kredor/punctuate-all")
 
 # --- Exit flag ---
 exit_requested = False
@@ -136,46 +269,110 @@ def exit_program():
         time.sleep(0.25)
     play_audio_file(EXIT_FILE)
     exit_requested = True
+    WAKE_EVT.set()
     print("\nExit button pressed. Cleaning up...")
 
 exit_button.when_pressed = exit_program
 
+def _vosk_model_path(path):
+    """
+    Prefer a quantized rebuild of the acoustic model (same directory name
+    with an -int8 suffix, prepared offline with Kaldi's fixed-point nnet3
+    tooling) when one is on the card; fall back to the stock FP32 model.
+    """
+    int8_path = path + "-int8"
+    return int8_path if os.path.isdir(int8_path) else path
+
+def _build_models(vosk_path, ct_path, sp_src_path, sp_tgt_path, piper_voice_path, piper_config_path):
+    sp_src = spm.SentencePieceProcessor()
+    sp_src.load(sp_src_path)
+    sp_tgt = spm.SentencePieceProcessor()
+    sp_tgt.load(sp_tgt_path)
+    model = vosk.Model(_vosk_model_path(vosk_path))
+    return {
+        "vosk": model,
+        "recognizer": vosk.KaldiRecognizer(model, 16000),
+        "translator": ctranslate2.Translator(
+            ct_path, device="cpu", compute_type="int8",
+            inter_threads=1, intra_threads=NUM_THREADS
+        ),
+        "sp_source": sp_src,
+        "sp_target": sp_tgt,
+        "piper_voice": piper_voice_path,
+        "piper_config": piper_config_path,
+        "piper_tts": (
+            PiperVoice.load(piper_voice_path, config_path=piper_config_path, use_cuda=False)
+            if PiperVoice is not None else None
+        ),
+        "use_vmap": os.path.exists(os.path.join(ct_path, "vmap")),
+    }
+
+def preload_all():
+    print("Loading EN->ES models")
+    MODELS["en_to_es"] = _build_models(
+        VOSK_EN, CT_EN_ES, SP_EN_ES_SRC, SP_EN_ES_TGT, PIPER_ES, PIPER_CONFIG_ES
+    )
+    print("Loading ES->EN models")
+    MODELS["es_to_en"] = _build_models(
+        VOSK_ES, CT_ES_EN, SP_ES_EN_SRC, SP_ES_EN_TGT, PIPER_EN, PIPER_CONFIG_EN
+    )
+    _malloc_trim()
+
+def _malloc_trim():
+    """
+    Hand freed allocator arenas back to the OS. Loading and int8-quantizing
+    the models leaves a lot of transient scratch that glibc would otherwise
+    keep, RAM the Pi needs for the resident models.
+    """
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass  # non-glibc platform; nothing to trim
+
 def load_models(direction):
-    global vosk_model, translator, sp_source, sp_target, piper_voice, piper_config
-    unload_models()
-    if direction == "en_to_es":
-        print("Loading EN->ES models")
-        vosk_model = vosk.Model(VOSK_EN)
-        translator = ctranslate2.Translator(CT_EN_ES, device="cpu")
-        sp_source = spm.SentencePieceProcessor()
-        sp_source.load(SP_EN_ES_SRC)
-        sp_target = spm.SentencePieceProcessor()
-        sp_target.load(SP_EN_ES_TGT)
-        piper_voice = PIPER_ES
-        piper_config = PIPER_CONFIG_ES
-    elif direction == "es_to_en":
-        print("Loading ES->EN models")
-        vosk_model = vosk.Model(VOSK_ES)
-        translator = ctranslate2.Translator(CT_ES_EN, device="cpu")
-        sp_source = spm.SentencePieceProcessor()
-        sp_source.load(SP_ES_EN_SRC)
-        sp_target = spm.SentencePieceProcessor()
-        sp_target.load(SP_ES_EN_TGT)
-        piper_voice = PIPER_EN
-        piper_config = PIPER_CONFIG_EN
-
-def unload_models():
-    global vosk_model, translator, sp_source, sp_target
-    vosk_model = None
-    translator = None
-    sp_source = None
-    sp_target = None
-    gc.collect()
+    global vosk_model, recognizer, translator, sp_source, sp_target, \
+        piper_voice, piper_config, piper_tts, use_vmap
+    models = MODELS[direction]
+    vosk_model = models["vosk"]
+    recognizer = models["recognizer"]
+    translator = models["translator"]
+    sp_source = models["sp_source"]
+    sp_target = models["sp_target"]
+    piper_voice = models["piper_voice"]
+    piper_config = models["piper_config"]
+    piper_tts = models["piper_tts"]
+    use_vmap = models["use_vmap"]
 
 def get_translation_direction():
     return "es_to_en" if direction_switch.value == 1 else "en_to_es"
 
 def play_audio_file(file_path):
+    prompt = PROMPTS.get(file_path)
+    if prompt is not None:
+        # Feed the cached frames to a raw-mode aplay and let it exit once
+        # the clip drains. The pipe must not be held open between prompts:
+        # plughw devices are single-open, so a lingering aplay would EBUSY
+        # every later playback (including speak()).
+        proc = None
+        try:
+            proc = subprocess.Popen(
+                ["aplay", "-D", APLAY_DEVICE, "-r", str(prompt["rate"]),
+                 "-c", str(prompt["channels"]), "-f", "S16_LE", "-t", "raw"],
+                stdin=subprocess.PIPE
+            )
+            proc.stdin.write(prompt["data"])
+            proc.stdin.close()
+            proc.wait()
+            return
+        except (BrokenPipeError, OSError):
+            # aplay died mid-clip; reap it, then retry via the per-file
+            # path below.
+            if proc is not None:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+                proc.wait()
     if os.path.exists(file_path):
         subprocess.run(["aplay", "-D", APLAY_DEVICE, file_path])
     else:
@@ -191,29 +388,150 @@ def play_no_audio(direction):
     else:
         play_audio_file(NO_AUDIO_ES_FILE)
 
-def transcribe(audio, samplerate):
-    rec = vosk.KaldiRecognizer(vosk_model, samplerate)
-    rec.AcceptWaveform(audio.tobytes())
-    result = json.loads(rec.FinalResult())
+# The input stream stays open for the program's lifetime (ALSA open/close
+# costs tens to hundreds of ms per recording on the Pi); the recording
+# flag gates whether captured blocks are fed to the recognizer.
+recording = False
+got_audio = False
+
+# AcceptWaveform runs on PortAudio's callback thread while FinalResult/
+# Reset run on the main thread, and Vosk recognizers are not thread-safe;
+# the lock keeps finalization from landing mid-AcceptWaveform when the
+# last in-flight block is still being processed.
+REC_LOCK = threading.Lock()
+
+def audio_callback(indata, frames_count, time_info, status):
+    global got_audio
+    if status:
+        print(status, file=sys.stderr)
+    if recording:
+        with REC_LOCK:
+            recognizer.AcceptWaveform(bytes(indata))
+        got_audio = True
+
+def transcribe():
+    """
+    Finalize the utterance fed into the persistent recognizer during
+    recording and reset it for the next one.
+    """
+    with REC_LOCK:
+        result = json.loads(recognizer.FinalResult())
+        recognizer.Reset()
     return result.get("text", "")
 
+SENTENCE_END = (".", "!", "?")
+EOS = "</s>"  # end-of-sentence marker the Opus-MT models expect appended
+PUNCT_MIN_WORDS = 6  # below this, Opus-MT copes fine without restored punctuation
+
+def punctuate(text):
+    """
+    Restore punctuation, but skip the model for short single-clause
+    utterances ("hello", "thank you") where it costs a few hundred ms on
+    the Pi and adds nothing; just make sure they end with a period.
+    """
+    if len(text.split()) >= PUNCT_MIN_WORDS and any(c.isalpha() for c in text):
+        return punct_model.restore_punctuation(text)
+    if not text.endswith(SENTENCE_END):
+        text += "."
+    return text
+
+def split_sentences(text):
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]
+
+@lru_cache(maxsize=256)
+def _translate_cached(direction, text):
+    # direction is part of the cache key; the loaded globals always match
+    # current_direction, so repeated phrases ("hola", "thank you") skip
+    # the SentencePiece + CTranslate2 work entirely on a hit.
+    sentences = split_sentences(text) or [text]
+    # Encoding the list in one call takes a single trip through the
+    # SentencePiece C++ layer instead of one per sentence.
+    batch = sp_source.encode(sentences, out_type=str)
+    for tokens in batch:
+        tokens.append(EOS)
+    results = translator.translate_batch(
+        batch,
+        beam_size=1,
+        num_hypotheses=1,
+        return_scores=False,
+        max_decoding_length=256,
+        max_batch_size=16,
+        use_vmap=use_vmap
+    )
+    return " ".join(sp_target.decode([r.hypotheses[0] for r in results]))
+
 def translate(text):
-    tokens = sp_source.encode(text, out_type=str)
-    tokens.append("</s>")
-    results = translator.translate_batch([tokens])
-    return sp_target.decode(results[0].hypotheses[0])
+    return _translate_cached(current_direction, text)
+
+# Worker pool for the punctuate -> translate stages. Vosk, ONNX Runtime,
+# CTranslate2 and Piper all release the GIL inside their C++ cores, so
+# work submitted here genuinely overlaps with the control loop and with
+# audio playback.
+PIPELINE = ThreadPoolExecutor(max_workers=2)
+
+def process_utterance(text):
+    text = punctuate(text)
+    print(f"Punctuated: {text}")
+    return translate(text)
 
-def speak(text):
+def speak(sentences):
+    """
+    Speak a string or an iterable of sentences. Sentences are synthesized
+    one at a time, so audio for the first sentence starts playing while
+    the later ones are still being synthesized.
+    """
+    if isinstance(sentences, str):
+        sentences = split_sentences(sentences) or [sentences]
+    aplay_cmd = ["aplay", "-D", APLAY_DEVICE, "-r", "22050", "-f", "S16_LE", "-t", "raw"]
+    if piper_tts is not None:
+        # Voice is already loaded in RAM. Synthesis runs on a worker
+        # thread feeding a bounded queue while this thread blocks on the
+        # real-time aplay writes, so sentence N+1 is synthesized while
+        # sentence N is playing.
+        aplay_proc = subprocess.Popen(aplay_cmd, stdin=subprocess.PIPE)
+        chunks = queue.Queue(maxsize=4)
+        synth_error = []
+
+        def synth():
+            try:
+                for sentence in sentences:
+                    sentence = sentence.strip()
+                    if not sentence:
+                        continue
+                    for chunk in piper_tts.synthesize_stream_raw(sentence):
+                        chunks.put(chunk)
+            except Exception as e:
+                synth_error.append(e)
+            finally:
+                chunks.put(None)  # always unblock the playback loop below
+
+        worker = threading.Thread(target=synth, daemon=True)
+        worker.start()
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            aplay_proc.stdin.write(chunk)
+        worker.join()
+        aplay_proc.stdin.close()
+        aplay_proc.wait()
+        if synth_error:
+            raise synth_error[0]
+        return
+    # piper-tts bindings unavailable: fall back to the standalone binary,
+    # paying its model load on every call.
     piper_proc = subprocess.Popen(
         [PIPER_BIN, "--model", piper_voice, "--config", piper_config, "--output-raw"],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE
     )
-    aplay_proc = subprocess.Popen(
-        ["aplay", "-D", APLAY_DEVICE, "-r", "22050", "-f", "S16_LE", "-t", "raw"],
-        stdin=piper_proc.stdout
-    )
-    piper_proc.stdin.write(text.encode("utf-8"))
+    aplay_proc = subprocess.Popen(aplay_cmd, stdin=piper_proc.stdout)
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        piper_proc.stdin.write((sentence + "\n").encode("utf-8"))
+        piper_proc.stdin.flush()
     piper_proc.stdin.close()
     aplay_proc.wait()
     piper_proc.wait()
@@ -225,7 +543,8 @@ def wait_for_button_or_switch_change(last_direction):
         new_direction = get_translation_direction()
         if new_direction != last_direction:
             return new_direction
-        time.sleep(0.01)
+        WAKE_EVT.wait()
+        WAKE_EVT.clear()
     return "exit"
 
 def wait_for_button_release_or_switch_change(last_direction):
@@ -233,14 +552,31 @@ def wait_for_button_release_or_switch_change(last_direction):
         new_direction = get_translation_direction()
         if new_direction != last_direction:
             return new_direction
-        time.sleep(0.01)
+        WAKE_EVT.wait()
+        WAKE_EVT.clear()
     if exit_requested:
         return "exit"
     return None
 
 try:
+    preload_all()
     current_direction = get_translation_direction()
     load_models(current_direction)
+
+    try:
+        stream = sd.RawInputStream(
+            samplerate=16000,
+            channels=1,
+            dtype='int16',
+            device=INPUT_DEVICE,
+            callback=audio_callback,
+            blocksize=1600
+        )
+        stream.start()
+    except Exception as e:
+        print(f"Failed to open input stream on {INPUT_DEVICE} with 16000 Hz: {e}")
+        # Optional: try alternate device or sample rate as fallback
+
     play_mode_announcement(current_direction)
 
     while not exit_requested:
@@ -257,28 +593,8 @@ try:
             play_mode_announcement(current_direction)
             continue
 
-        q = queue.Queue()
-        frames = []
+        got_audio = False
         recording = True
-
-        def callback(indata, frames_count, time_info, status):
-            if status:
-                print(status, file=sys.stderr)
-            if recording:
-                q.put(indata.copy())
-
-        try:
-            stream = sd.InputStream(
-                samplerate=16000,
-                channels=1,
-                dtype='int16',
-                device=INPUT_DEVICE,
-                callback=callback
-            )
-            stream.start()
-        except Exception as e:
-            print(f"Failed to open input stream on {INPUT_DEVICE} with 16000 Hz: {e}")
-            # Optional: try alternate device or sample rate as fallback
         red_led.on()
         print("Recording... (release button to stop, or toggle switch to change direction)")
         direction_changed = None
@@ -286,29 +602,26 @@ try:
             direction_changed = wait_for_button_release_or_switch_change(current_direction)
         finally:
             recording = False
-            stream.stop()
-            stream.close()
             red_led.off()
 
         if exit_requested or direction_changed == "exit":
             break
         elif direction_changed:
+            with REC_LOCK:
+                recognizer.Reset()  # discard audio from the aborted recording
             current_direction = direction_changed
             load_models(current_direction)
             play_mode_announcement(current_direction)
             continue
 
-        while not q.empty():
-            frames.append(q.get())
-        audio = np.concatenate(frames, axis=0) if frames else np.array([], dtype='int16')
-        if audio.size == 0:
+        if not got_audio:
             print("No audio recorded")
             play_no_audio(current_direction)
             continue
 
         print("Transcribing...")
         red_led.on()
-        text = transcribe(audio, 16000)
+        text = transcribe()
         red_led.off()
         print(f"Recognized: {text}")
 
@@ -317,15 +630,20 @@ try:
             play_no_audio(current_direction)
             continue
 
-        # --- PUNCTUATE ---
-        print("Restoring punctuation...")
-        text = punct_model.restore_punctuation(text)
-        print(f"Punctuated: {text}")
-
-        print("Translating...")
+        # --- PUNCTUATE + TRANSLATE (off the control thread) ---
+        print("Punctuating and translating...")
         red_led.on()
-        translation = translate(text)
+        future = PIPELINE.submit(process_utterance, text)
+        translation = None
+        while not exit_requested:
+            try:
+                translation = future.result(timeout=0.1)
+                break
+            except FutureTimeout:
+                continue
         red_led.off()
+        if exit_requested or translation is None:
+            break
 
         green_led.on()
         print(f"Translation: {translation}\nPress button to play translation (or toggle switch to change direction).")
@@ -342,7 +660,8 @@ try:
                 play_mode_announcement(current_direction)
                 play_translation = False
                 break
-            time.sleep(0.01)
+            WAKE_EVT.wait()
+            WAKE_EVT.clear()
         green_led.off()
         if exit_requested:
             break